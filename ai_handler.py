@@ -4,8 +4,9 @@ AI handler for processing queries using Gemini API
 import google.generativeai as genai
 from typing import List, Dict, Optional
 import logging
-import tiktoken
 from config import Config
+from token_budget import TokenBudget
+from tokens import count_tokens, chunk_terms
 
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
@@ -21,51 +22,40 @@ class AIHandler:
         genai.configure(api_key=self.config.GEMINI_API_KEY)
         self.model = genai.GenerativeModel(self.config.MODEL_NAME)
         
-        # Initialize tokenizer for token counting
-        try:
-            self.tokenizer = tiktoken.get_encoding("cl100k_base")
-        except Exception as e:
-            logger.warning(f"Could not initialize tokenizer: {e}")
-            self.tokenizer = None
+        # Token budget shared by all queries in this session
+        self.budget = TokenBudget(self.config)
     
     def count_tokens(self, text: str) -> int:
         """Count tokens in text"""
-        if self.tokenizer:
-            return len(self.tokenizer.encode(text))
-        else:
-            # Rough estimation: ~4 characters per token
-            return len(text) // 4
+        return count_tokens(text)
     
     def select_relevant_chunks(self, chunks: List[Dict], query: str, max_tokens: int = 600) -> List[Dict]:
         """Select most relevant chunks for the query"""
         # Simple keyword-based relevance scoring
-        query_words = set(query.lower().split())
+        query_words = chunk_terms(query)
         
-        scored_chunks = []
-        for chunk in chunks:
-            chunk_words = set(chunk['text'].lower().split())
-            # Calculate overlap score
-            overlap = len(query_words.intersection(chunk_words))
-            score = overlap / len(query_words) if query_words else 0
-            
-            scored_chunks.append({
-                'chunk': chunk,
-                'score': score
-            })
-        
-        # Sort by relevance score
-        scored_chunks.sort(key=lambda x: x['score'], reverse=True)
+        if hasattr(chunks, 'rank'):
+            # Loaded sessions rank from their stored term index and token counts,
+            # so only the selected chunks are decoded
+            ranked = chunks.rank(query_words)
+            chunk_tokens_for = chunks.token_count
+        else:
+            # Overlap count orders chunks the same as overlap / len(query_words)
+            scores = [len(query_words.intersection(chunk_terms(chunk['text']))) for chunk in chunks]
+            # sorted() is stable, so equally scored chunks keep document order
+            ranked = sorted(range(len(chunks)), key=lambda i: scores[i], reverse=True)
+            chunk_tokens_for = lambda i: self.count_tokens(chunks[i]['text'])
         
         # Select chunks within token limit
         selected_chunks = []
         total_tokens = 0
         
-        for item in scored_chunks:
-            chunk = item['chunk']
-            chunk_tokens = self.count_tokens(chunk['text'])
+        for index in ranked:
+            chunk_tokens = chunk_tokens_for(index)
             
-            if total_tokens + chunk_tokens <= max_tokens:
-                selected_chunks.append(chunk)
+            # Always keep the best chunk so a tight budget still gets an answer
+            if total_tokens + chunk_tokens <= max_tokens or not selected_chunks:
+                selected_chunks.append(chunks[index])
                 total_tokens += chunk_tokens
             else:
                 break
@@ -173,8 +163,16 @@ Answer:"""
             query_type = self.classify_query_type(question)
             logger.info(f"Query classified as: {query_type}")
             
+            # Size the request for this query type and current spend
+            plan = self.budget.plan(query_type)
+            if plan['exhausted']:
+                return {
+                    'success': False,
+                    'error': f"Token budget exhausted ({plan['remaining']} tokens remaining)"
+                }
+            
             # Select relevant chunks
-            relevant_chunks = self.select_relevant_chunks(chunks, question, self.config.MAX_TOKENS_PER_REQUEST)
+            relevant_chunks = self.select_relevant_chunks(chunks, question, plan['context_tokens'])
             
             if not relevant_chunks:
                 return {
@@ -194,16 +192,29 @@ Answer:"""
                 prompt,
                 generation_config=genai.types.GenerationConfig(
                     temperature=self.config.TEMPERATURE,
-                    max_output_tokens=400  # Leave room for response
+                    max_output_tokens=plan['output_tokens']
                 )
             )
             
+            # Prefer the API's own usage numbers when available
+            usage = getattr(response, 'usage_metadata', None)
+            if usage and getattr(usage, 'prompt_token_count', None):
+                prompt_tokens = usage.prompt_token_count
+            output_tokens = getattr(usage, 'candidates_token_count', None) if usage else None
+            if output_tokens is None:
+                output_tokens = self.count_tokens(response.text)
+            
+            spend = self.budget.record(prompt_tokens, output_tokens)
+            
             return {
                 'success': True,
                 'answer': response.text,
                 'query_type': query_type,
                 'chunks_used': len(relevant_chunks),
-                'prompt_tokens': prompt_tokens
+                'prompt_tokens': prompt_tokens,
+                'output_tokens': output_tokens,
+                'budget_degraded': plan['degraded'],
+                'spend': spend
             }
             
         except Exception as e:
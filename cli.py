@@ -6,6 +6,9 @@ import os
 import sys
 from pdf_processor import PDFProcessor
 from ai_handler import AIHandler
+from config import Config
+from session_store import save_session, load_session, SESSION_EXTENSION
+from ingest_daemon import IngestionDaemon
 import logging
 
 logging.basicConfig(level=logging.INFO)
@@ -48,6 +51,40 @@ class ChatPDFCLI:
             click.echo(f"Error loading PDF: {e}", err=True)
             return False
     
+    def load_session(self, session_path: str) -> bool:
+        """Load a previously saved session file"""
+        if not os.path.exists(session_path):
+            click.echo(f"Error: Session file '{session_path}' not found.", err=True)
+            return False
+        
+        try:
+            session = load_session(session_path)
+        except Exception as e:
+            click.echo(f"Error loading session: {e}", err=True)
+            return False
+        
+        self.current_pdf_data = session
+        self.current_pdf_path = session.pdf_path or session_path
+        
+        click.echo(f"✓ Session loaded: {session_path}")
+        click.echo(f"  - Total characters: {session['total_chars']:,}")
+        click.echo(f"  - Text chunks: {session['num_chunks']}")
+        return True
+    
+    def save_session(self, session_path: str) -> bool:
+        """Save the currently loaded PDF to a session file"""
+        if not self.current_pdf_data:
+            click.echo("Error: No PDF loaded. Please load a PDF first.", err=True)
+            return False
+        
+        try:
+            save_session(session_path, self.current_pdf_data, self.current_pdf_path)
+            click.echo(f"✓ Session saved: {session_path}")
+            return True
+        except Exception as e:
+            click.echo(f"Error saving session: {e}", err=True)
+            return False
+    
     def ask_question(self, question: str) -> None:
         """Process a question about the loaded PDF"""
         if not self.current_pdf_data:
@@ -66,7 +103,12 @@ class ChatPDFCLI:
                 click.echo("-" * 50)
                 click.echo(result['answer'])
                 click.echo("-" * 50)
-                click.echo(f"📊 Used {result['chunks_used']} text chunks, {result['prompt_tokens']} tokens")
+                click.echo(f"📊 Used {result['chunks_used']} text chunks, {result['prompt_tokens']} prompt + {result['output_tokens']} output tokens")
+                spend = result['spend']
+                click.echo(f"💰 Spend: {spend['query_tokens']} this query, {spend['session_tokens']} this session, "
+                           f"{spend['daily_tokens']} today ({spend['remaining']} remaining)")
+                if result['budget_degraded']:
+                    click.echo("⚠️  Budget is running low: answer was shortened to save tokens")
             else:
                 click.echo(f"Error: {result['error']}", err=True)
                 
@@ -108,15 +150,28 @@ def cli():
     pass
 
 @cli.command()
-@click.argument('pdf_path', type=click.Path(exists=True))
+@click.argument('pdf_path', type=click.Path(exists=True), required=False)
 @click.option('--question', '-q', help='Ask a single question')
 @click.option('--interactive', '-i', is_flag=True, help='Start interactive mode')
-def chat(pdf_path, question, interactive):
-    """Chat with a PDF file"""
+@click.option('--session', '-s', 'session_path', type=click.Path(exists=True), help='Load a saved session instead of a PDF')
+@click.option('--save-session', 'save_path', type=click.Path(), help='Save the processed PDF to a session file')
+def chat(pdf_path, question, interactive, session_path, save_path):
+    """Chat with a PDF file or a saved session"""
+    if not pdf_path and not session_path:
+        click.echo("Error: Provide a PDF file or --session.", err=True)
+        sys.exit(1)
+    
     app = ChatPDFCLI()
     
-    # Load the PDF
-    if not app.load_pdf(pdf_path):
+    if session_path:
+        # Load the saved session
+        if not app.load_session(session_path):
+            sys.exit(1)
+    elif not app.load_pdf(pdf_path):
+        # Load the PDF
+        sys.exit(1)
+    
+    if save_path and not app.save_session(save_path):
         sys.exit(1)
     
     if question:
@@ -166,6 +221,60 @@ def test(pdf_path):
         app.ask_question(question)
         click.echo("\n" + "=" * 60)
 
+@cli.command()
+@click.argument('pdf_path', type=click.Path(exists=True))
+@click.argument('session_path', type=click.Path(), required=False)
+def save(pdf_path, session_path):
+    """Process a PDF and save it as a session file"""
+    # No API calls are made, so this does not need ChatPDFCLI/AIHandler or an API key
+    if not session_path:
+        name = os.path.splitext(os.path.basename(pdf_path))[0]
+        session_path = os.path.join(Config.SESSION_DIRECTORY, name + SESSION_EXTENSION)
+    
+    click.echo(f"Loading PDF: {pdf_path}")
+    result = PDFProcessor().process_pdf(pdf_path, Config.CHUNK_SIZE, Config.CHUNK_OVERLAP)
+    if not result['success']:
+        click.echo(f"Error processing PDF: {result['error']}", err=True)
+        sys.exit(1)
+    
+    try:
+        save_session(session_path, result, pdf_path)
+    except Exception as e:
+        click.echo(f"Error saving session: {e}", err=True)
+        sys.exit(1)
+    
+    click.echo(f"✓ Session saved: {session_path}")
+    click.echo(f"  - Total characters: {result['total_chars']:,}")
+    click.echo(f"  - Text chunks: {result['num_chunks']}")
+
+@cli.command()
+@click.option('--directory', '-d', type=click.Path(), help='Directory to watch (default: Config.PDF_DIRECTORY)')
+@click.option('--workers', '-w', type=int, help='Number of worker threads')
+@click.option('--queue-size', type=int, help='Maximum number of queued PDFs')
+@click.option('--interval', type=float, help='Seconds between directory scans')
+@click.option('--once', is_flag=True, help='Process the current files and exit')
+def ingest(directory, workers, queue_size, interval, once):
+    """Watch a directory and save processed PDFs as sessions"""
+    daemon = IngestionDaemon(watch_dir=directory, workers=workers,
+                             max_queue=queue_size, poll_interval=interval)
+    
+    def show_stats(stats):
+        click.echo(f"📥 Queue: {stats['queue_depth']} | Processing: {stats['in_progress']} | "
+                   f"Done: {stats['processed']} | Failed: {stats['failed']} | "
+                   f"Retrying: {stats['retrying']} | Deferred: {stats['deferred']} | Settling: {stats['pending']} | "
+                   f"{stats['throughput_per_min']:.1f}/min")
+    
+    if once:
+        stats = daemon.run_once()
+        show_stats(stats)
+        sys.exit(1 if stats['failed'] else 0)
+    
+    click.echo(f"👀 Watching {daemon.watch_dir} (Ctrl+C to stop)")
+    try:
+        daemon.run(stats_callback=show_stats)
+    except KeyboardInterrupt:
+        click.echo("\n👋 Stopping ingestion...")
+
 @cli.command()
 def info():
     """Show system information"""
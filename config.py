@@ -2,35 +2,84 @@
 Configuration management for ChatPDF clone
 """
 import os
+import logging
 from dotenv import load_dotenv
 
 # Load environment variables
 load_dotenv()
 
+logger = logging.getLogger(__name__)
+
+def _env_int(name: str, default: int) -> int:
+    """Read an integer setting from the environment, keeping the default if it is malformed"""
+    value = os.getenv(name)
+    if value is None:
+        return default
+    try:
+        return int(value)
+    except ValueError:
+        logger.warning(f"Ignoring {name}={value!r}: not a whole number, using {default}")
+        return default
+
 class Config:
     """Configuration class for the application"""
     
     # API Configuration
     GEMINI_API_KEY = os.getenv('GEMINI_API_KEY')
     
-    # Token limits for cost optimization
-    MAX_TOKENS_PER_REQUEST = 800
-    MAX_CONTEXT_LENGTH = 4000
-    
     # PDF Processing settings
     CHUNK_SIZE = 1000  # Characters per chunk
     CHUNK_OVERLAP = 200  # Overlap between chunks
     
+    # Token limits for cost optimization
+    MAX_TOKENS_PER_REQUEST = 800  # Upper bound on context tokens sent per request
+    MAX_CONTEXT_LENGTH = 4000  # Upper bound on prompt + output tokens per request
+    
+    # Token budget per query type: (context tokens, output tokens)
+    QUERY_TOKEN_BUDGETS = {
+        'direct': (500, 200),
+        'indirect': (800, 500),
+        'references': (800, 400),
+        'general': (700, 400),
+    }
+    PROMPT_OVERHEAD_TOKENS = 150  # Instructions and question around the context
+    MIN_CONTEXT_TOKENS = CHUNK_SIZE // 4 + 100  # Room for at least one full chunk
+    MIN_OUTPUT_TOKENS = 100
+    
+    # Cumulative spend caps
+    SESSION_TOKEN_CAP = _env_int('SESSION_TOKEN_CAP', 50000)
+    DAILY_TOKEN_CAP = _env_int('DAILY_TOKEN_CAP', 200000)
+    BUDGET_PRESSURE_THRESHOLD = 0.25  # Start shrinking requests below this fraction remaining
+    USAGE_FILE = './.chatpdf_usage.json'
+    
     # Model settings
     MODEL_NAME = 'gemini-1.5-flash'  # Updated model name
     TEMPERATURE = 0.1  # Low temperature for factual responses
     
     # File paths
     PDF_DIRECTORY = './pdfs'
+    SESSION_DIRECTORY = './sessions'
+    
+    # Ingestion daemon settings
+    INGEST_WORKERS = 2
+    INGEST_QUEUE_SIZE = 20  # Scans defer new files once this many are waiting
+    INGEST_POLL_INTERVAL = 5.0  # Seconds between directory scans
+    INGEST_SETTLE_SECONDS = 2.0  # Ignore files modified more recently than this
+    INGEST_MAX_RETRIES = 3  # Attempts per file version before waiting for it to change
+    INGEST_RETRY_DELAY = 30.0  # Seconds before the first retry; doubles on each attempt
     
     @classmethod
     def validate(cls):
         """Validate configuration settings"""
         if not cls.GEMINI_API_KEY:
             raise ValueError("GEMINI_API_KEY is required")
+        for name in ('SESSION_TOKEN_CAP', 'DAILY_TOKEN_CAP'):
+            value = os.getenv(name)
+            if value is not None:
+                try:
+                    int(value)
+                except ValueError:
+                    raise ValueError(f"{name} must be a whole number of tokens, got {value!r}")
+        if cls.SESSION_TOKEN_CAP <= 0 or cls.DAILY_TOKEN_CAP <= 0:
+            raise ValueError("SESSION_TOKEN_CAP and DAILY_TOKEN_CAP must be positive")
         return True
@@ -0,0 +1,281 @@
+"""
+Watch-folder ingestion daemon that processes new PDFs into session files
+"""
+import os
+import queue
+import threading
+import time
+from typing import Dict, List, Optional
+import logging
+from config import Config
+from pdf_processor import PDFProcessor
+from session_store import save_session, SESSION_EXTENSION
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+try:
+    # Optional: wake up on filesystem events instead of waiting for the next poll (Linux only)
+    from inotify_simple import INotify, flags as inotify_flags
+except ImportError:
+    INotify = None
+
+class IngestionDaemon:
+    """Watches a directory and processes new or changed PDFs with a bounded worker pool"""
+
+    def __init__(self, watch_dir: Optional[str] = None, session_dir: Optional[str] = None,
+                 workers: Optional[int] = None, max_queue: Optional[int] = None,
+                 poll_interval: Optional[float] = None):
+        self.config = Config()
+        self.watch_dir = watch_dir or self.config.PDF_DIRECTORY
+        self.session_dir = session_dir or self.config.SESSION_DIRECTORY
+        self.num_workers = workers or self.config.INGEST_WORKERS
+        self.poll_interval = poll_interval or self.config.INGEST_POLL_INTERVAL
+        self.queue = queue.Queue(maxsize=max_queue or self.config.INGEST_QUEUE_SIZE)
+
+        self._signatures = {}  # path -> (mtime_ns, size) last saved successfully
+        self._failures = {}  # path -> (signature, attempts, next retry time)
+        self._in_flight = set()  # paths queued or being processed
+        self._lock = threading.Lock()
+        self._stop_event = threading.Event()
+        self._workers = []
+        self._inotify = None
+
+        self.started_at = None
+        self.processed = 0
+        self.failed = 0
+        self.deferred = 0  # files left unqueued because the queue was full, as of the last scan
+        self.pending = 0  # changed files waiting to settle or for their current run, as of the last scan
+        self.in_progress = 0
+        self.last_error = None
+
+    def session_path_for(self, pdf_path: str) -> str:
+        """Return the session file path for a PDF"""
+        name = os.path.splitext(os.path.basename(pdf_path))[0]
+        return os.path.join(self.session_dir, name + SESSION_EXTENSION)
+
+    def _needs_processing(self, pdf_path: str, signature: tuple) -> bool:
+        """Check whether a PDF is new or has changed since it was last saved"""
+        with self._lock:
+            if self._signatures.get(pdf_path) == signature:
+                return False
+            seen = pdf_path in self._signatures
+
+        if not seen:
+            # First sighting: an up-to-date session from an earlier run is enough
+            session_path = self.session_path_for(pdf_path)
+            if os.path.exists(session_path) and os.stat(session_path).st_mtime_ns >= signature[0]:
+                with self._lock:
+                    self._signatures[pdf_path] = signature
+                return False
+
+        return True
+
+    def _retry_due(self, pdf_path: str, signature: tuple) -> bool:
+        """Check whether a failed PDF may be tried again (a changed file always may)"""
+        with self._lock:
+            failure = self._failures.get(pdf_path)
+        if failure is None or failure[0] != signature:
+            return True
+        _, attempts, next_retry = failure
+        return attempts < self.config.INGEST_MAX_RETRIES and time.time() >= next_retry
+
+    def _is_settled(self, signature: tuple) -> bool:
+        """Check that a file has not been modified recently (i.e. is not still being written)"""
+        return time.time() - signature[0] / 1e9 >= self.config.INGEST_SETTLE_SECONDS
+
+    def scan(self) -> List[str]:
+        """Queue new or changed PDFs, deferring the rest when the queue is full"""
+        queued = []
+        pending = 0
+        deferred = 0
+        try:
+            entries = sorted(os.scandir(self.watch_dir), key=lambda entry: entry.name)
+        except FileNotFoundError:
+            logger.warning(f"Watch directory {self.watch_dir} does not exist")
+            with self._lock:
+                self.pending = 0
+                self.deferred = 0
+            return queued
+
+        for entry in entries:
+            if not entry.is_file() or not entry.name.lower().endswith('.pdf'):
+                continue
+
+            stat = entry.stat()
+            signature = (stat.st_mtime_ns, stat.st_size)
+            if not self._needs_processing(entry.path, signature):
+                continue
+            if not self._retry_due(entry.path, signature):
+                continue
+            with self._lock:
+                busy = entry.path in self._in_flight
+            if busy or not self._is_settled(signature):
+                # Still being written, or a worker is on the previous version; a later
+                # scan picks it up, so two workers never write the same session
+                pending += 1
+                continue
+
+            if deferred:
+                deferred += 1
+                continue
+
+            # Mark in flight before queueing so a fast worker cannot finish first
+            with self._lock:
+                self._in_flight.add(entry.path)
+            try:
+                self.queue.put_nowait((entry.path, signature))
+            except queue.Full:
+                # Back-pressure: leave this and the remaining files for a later scan
+                with self._lock:
+                    self._in_flight.discard(entry.path)
+                deferred += 1
+                continue
+
+            queued.append(entry.path)
+
+        with self._lock:
+            self.pending = pending
+            self.deferred = deferred
+        if deferred:
+            logger.warning(f"Ingestion queue full ({self.queue.qsize()}), deferred {deferred} PDF(s)")
+        if queued:
+            logger.info(f"Queued {len(queued)} PDF(s) for ingestion")
+        return queued
+
+    def _worker(self) -> None:
+        """Process queued PDFs until a stop sentinel is received"""
+        processor = PDFProcessor()
+
+        while True:
+            item = self.queue.get()
+            if item is None:
+                self.queue.task_done()
+                break
+            pdf_path, signature = item
+
+            with self._lock:
+                self.in_progress += 1
+
+            try:
+                result = processor.process_pdf(pdf_path, self.config.CHUNK_SIZE, self.config.CHUNK_OVERLAP)
+                if not result['success']:
+                    raise ValueError(result['error'])
+
+                save_session(self.session_path_for(pdf_path), result, pdf_path)
+                with self._lock:
+                    # Only a saved session marks this version as done
+                    self._signatures[pdf_path] = signature
+                    self._failures.pop(pdf_path, None)
+                    self.processed += 1
+
+            except Exception as e:
+                logger.error(f"Error ingesting {pdf_path}: {e}")
+                with self._lock:
+                    previous = self._failures.get(pdf_path)
+                    attempts = previous[1] + 1 if previous and previous[0] == signature else 1
+                    delay = self.config.INGEST_RETRY_DELAY * 2 ** (attempts - 1)
+                    self._failures[pdf_path] = (signature, attempts, time.time() + delay)
+                    self.failed += 1
+                    self.last_error = f"{os.path.basename(pdf_path)}: {e}"
+            finally:
+                with self._lock:
+                    self.in_progress -= 1
+                    self._in_flight.discard(pdf_path)
+                self.queue.task_done()
+
+    def start(self) -> None:
+        """Start the worker pool"""
+        self.started_at = time.time()
+        self._stop_event.clear()
+
+        for i in range(self.num_workers):
+            worker = threading.Thread(target=self._worker, name=f"ingest-worker-{i}", daemon=True)
+            worker.start()
+            self._workers.append(worker)
+
+        if INotify is not None and os.path.isdir(self.watch_dir):
+            self._inotify = INotify()
+            self._inotify.add_watch(self.watch_dir, inotify_flags.CLOSE_WRITE | inotify_flags.MOVED_TO)
+
+        logger.info(f"Ingestion started: {self.num_workers} worker(s) watching {self.watch_dir} "
+                    f"({'inotify' if self._inotify else 'polling'})")
+
+    def stop(self) -> None:
+        """Stop the workers after they finish the files they are currently processing"""
+        self._stop_event.set()
+
+        # Drop waiting files so shutdown is not held up; they are requeued on the next run
+        while True:
+            try:
+                pdf_path, _ = self.queue.get_nowait()
+            except queue.Empty:
+                break
+            with self._lock:
+                self._in_flight.discard(pdf_path)
+            self.queue.task_done()
+
+        for _ in self._workers:
+            self.queue.put(None)
+        for worker in self._workers:
+            worker.join()
+        self._workers = []
+
+        if self._inotify is not None:
+            self._inotify.close()
+            self._inotify = None
+
+    def _wait_for_changes(self) -> None:
+        """Block until the next scan is due"""
+        if self._inotify is not None:
+            # Returns early on filesystem events; the timeout keeps settle/back-pressure retries going
+            self._inotify.read(timeout=int(self.poll_interval * 1000))
+        else:
+            self._stop_event.wait(self.poll_interval)
+
+    def run(self, stats_callback=None) -> None:
+        """Scan and process continuously until stop() is called or interrupted"""
+        self.start()
+        try:
+            while not self._stop_event.is_set():
+                self.scan()
+                if stats_callback:
+                    stats_callback(self.stats())
+                self._wait_for_changes()
+        finally:
+            self.stop()
+
+    def run_once(self) -> Dict:
+        """Process everything currently in the watch directory, then stop"""
+        self.start()
+        try:
+            while True:
+                self.scan()
+                self.queue.join()
+                if self.deferred:
+                    continue
+                if not self.pending:
+                    break
+                # Wait for files that are still being written instead of skipping them
+                logger.info(f"Waiting for {self.pending} PDF(s) still being written or reprocessed")
+                time.sleep(min(self.config.INGEST_SETTLE_SECONDS, self.poll_interval))
+        finally:
+            self.stop()
+        return self.stats()
+
+    def stats(self) -> Dict:
+        """Return queue depth, throughput and failure counts"""
+        elapsed = time.time() - self.started_at if self.started_at else 0
+        with self._lock:
+            return {
+                'queue_depth': self.queue.qsize(),
+                'in_progress': self.in_progress,
+                'processed': self.processed,
+                'failed': self.failed,
+                'deferred': self.deferred,
+                'pending': self.pending,
+                'retrying': sum(1 for _, attempts, _ in self._failures.values()
+                                if attempts < self.config.INGEST_MAX_RETRIES),
+                'throughput_per_min': self.processed / elapsed * 60 if elapsed else 0.0,
+                'last_error': self.last_error
+            }
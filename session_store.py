@@ -0,0 +1,337 @@
+"""
+Binary session snapshots for processed PDFs.
+
+A session file stores everything ``PDFProcessor.process_pdf`` produces (raw text,
+clean text and chunks) plus per-chunk token counts and an inverted term index
+in a single versioned file.
+Loading maps the file with ``mmap`` and only decodes text when it is accessed,
+so reopening a session is independent of document size and several processes
+reading the same file share the same pages.
+
+Layout (all integers little-endian):
+
+    header    magic (8s) | version (H) | reserved (H) | index length (I)
+    index     UTF-8 JSON with metadata and section offsets
+    chunks    one fixed-size record per chunk (see CHUNK_RECORD)
+    terms     one fixed-size record per term, sorted by UTF-8 bytes (see TERM_RECORD)
+    term text term strings as UTF-8
+    postings  chunk indices (uint32) for each term
+    clean     clean text as UTF-8
+    raw       raw text as UTF-8
+"""
+import json
+import mmap
+import os
+import struct
+import tempfile
+import time
+from collections.abc import Mapping, Sequence
+from typing import Dict, List, Optional
+import logging
+from tokens import count_tokens, chunk_terms
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+SESSION_MAGIC = b'CPDFSESS'
+SESSION_VERSION = 2
+SESSION_EXTENSION = '.cpdfs'
+
+HEADER = struct.Struct('<8sHHI')
+# id, start_pos, end_pos, text byte offset (into clean section), text byte length, token count
+CHUNK_RECORD = struct.Struct('<IIIIII')
+# term byte offset (into term text section), term byte length, first posting index, posting count
+TERM_RECORD = struct.Struct('<IIII')
+POSTING = struct.Struct('<I')
+
+
+def _chunk_byte_spans(clean_text: str, chunks: List[Dict]) -> List[tuple]:
+    """Locate each chunk's text inside clean_text and return (byte_offset, byte_length)"""
+    spans = []
+    char_pos = 0
+    byte_pos = 0
+    for chunk in chunks:
+        text = chunk['text']
+        index = clean_text.find(text, chunk.get('start_pos', 0))
+        if index < 0:
+            raise ValueError(f"Chunk {chunk['id']} text not found in clean text")
+        if index < char_pos:
+            # Chunks normally move forward; restart the running byte count if not
+            char_pos, byte_pos = 0, 0
+        byte_pos += len(clean_text[char_pos:index].encode('utf-8'))
+        char_pos = index
+        spans.append((byte_pos, len(text.encode('utf-8'))))
+    return spans
+
+
+def _build_term_index(chunks: List[Dict]) -> tuple:
+    """Build the term table, term text and postings sections for the chunks"""
+    postings = {}
+    for index, chunk in enumerate(chunks):
+        for term in chunk_terms(chunk['text']):
+            postings.setdefault(term.encode('utf-8'), []).append(index)
+
+    term_table = bytearray()
+    term_text = bytearray()
+    posting_list = []
+    for term in sorted(postings):
+        term_table += TERM_RECORD.pack(len(term_text), len(term), len(posting_list), len(postings[term]))
+        term_text += term
+        posting_list.extend(postings[term])
+    return term_table, term_text, struct.pack(f'<{len(posting_list)}I', *posting_list)
+
+
+def save_session(session_path: str, pdf_data: Dict, pdf_path: Optional[str] = None) -> str:
+    """Write processed PDF data to a binary session file"""
+    clean_bytes = pdf_data['clean_text'].encode('utf-8')
+    raw_bytes = pdf_data['raw_text'].encode('utf-8')
+    chunks = pdf_data['chunks']
+    spans = _chunk_byte_spans(pdf_data['clean_text'], chunks)
+
+    chunk_table = bytearray()
+    for chunk, (offset, length) in zip(chunks, spans):
+        chunk_table += CHUNK_RECORD.pack(
+            chunk['id'], chunk['start_pos'], chunk['end_pos'],
+            offset, length, count_tokens(chunk['text'])
+        )
+    term_table, term_text, postings = _build_term_index(chunks)
+
+    # Section offsets depend on the index length, which in turn contains them,
+    # so reserve fixed-width fields and fill them in afterwards.
+    index = {
+        'pdf_path': pdf_path,
+        'created': time.time(),
+        'total_chars': pdf_data['total_chars'],
+        'num_chunks': len(chunks),
+        'sections': {
+            'chunks': [0, len(chunk_table)],
+            'terms': [0, len(term_table)],
+            'term_text': [0, len(term_text)],
+            'postings': [0, len(postings)],
+            'clean_text': [0, len(clean_bytes)],
+            'raw_text': [0, len(raw_bytes)],
+        },
+    }
+    base = HEADER.size + len(json.dumps(index).encode('utf-8')) + 64
+    position = base
+    payloads = (
+        ('chunks', chunk_table), ('terms', term_table), ('term_text', term_text),
+        ('postings', postings), ('clean_text', clean_bytes), ('raw_text', raw_bytes),
+    )
+    for name, payload in payloads:
+        index['sections'][name][0] = position
+        position += len(payload)
+    index_bytes = json.dumps(index).encode('utf-8').ljust(base - HEADER.size)
+
+    directory = os.path.dirname(os.path.abspath(session_path))
+    os.makedirs(directory, exist_ok=True)
+    # Unique temp file per call so concurrent writers never share one
+    fd, tmp_path = tempfile.mkstemp(dir=directory, prefix=os.path.basename(session_path) + '.', suffix='.tmp')
+    try:
+        with os.fdopen(fd, 'wb') as file:
+            file.write(HEADER.pack(SESSION_MAGIC, SESSION_VERSION, 0, len(index_bytes)))
+            file.write(index_bytes)
+            for _, payload in payloads:
+                file.write(payload)
+        # mkstemp creates 0600 files; sessions are meant to be shared between processes
+        os.chmod(tmp_path, 0o644)
+        # Atomic replace so readers never map a half-written file
+        os.replace(tmp_path, session_path)
+    except BaseException:
+        os.unlink(tmp_path)
+        raise
+
+    logger.info(f"Saved session with {len(chunks)} chunks to {session_path}")
+    return session_path
+
+
+class SessionChunks(Sequence):
+    """Read-only chunk list backed by the mapped session file.
+
+    Chunk dictionaries are built on first access and cached, so only the chunks
+    actually used are decoded. ``rank`` scores chunks from the stored term index
+    without decoding any chunk text.
+    """
+
+    def __init__(self, buffer: memoryview, sections: Dict, count: int):
+        self._buffer = buffer
+        self._count = count
+        self._table_offset = sections['chunks'][0]
+        self._text_offset = sections['clean_text'][0]
+        self._terms_offset = sections['terms'][0]
+        self._num_terms = sections['terms'][1] // TERM_RECORD.size
+        self._term_text_offset = sections['term_text'][0]
+        self._postings_offset = sections['postings'][0]
+        self._cache = {}
+
+    def __len__(self) -> int:
+        return self._count
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return [self[i] for i in range(*index.indices(self._count))]
+        if index < 0:
+            index += self._count
+        if not 0 <= index < self._count:
+            raise IndexError('chunk index out of range')
+
+        if index not in self._cache:
+            chunk_id, start_pos, end_pos, offset, length, tokens = CHUNK_RECORD.unpack_from(
+                self._buffer, self._table_offset + index * CHUNK_RECORD.size
+            )
+            start = self._text_offset + offset
+            self._cache[index] = {
+                'id': chunk_id,
+                'text': str(self._buffer[start:start + length], 'utf-8'),
+                'start_pos': start_pos,
+                'end_pos': end_pos,
+                'token_count': tokens,
+            }
+        return self._cache[index]
+
+    def token_count(self, index: int) -> int:
+        """Return a chunk's precomputed token count without decoding its text"""
+        return CHUNK_RECORD.unpack_from(self._buffer, self._table_offset + index * CHUNK_RECORD.size)[5]
+
+    def token_counts(self) -> List[int]:
+        """Return precomputed token counts without decoding any chunk text"""
+        return [self.token_count(i) for i in range(self._count)]
+
+    def postings(self, term: str) -> List[int]:
+        """Return indices of the chunks containing term (binary search over the term table)"""
+        target = term.encode('utf-8')
+        low, high = 0, self._num_terms
+        while low < high:
+            mid = (low + high) // 2
+            offset, length, first, count = TERM_RECORD.unpack_from(
+                self._buffer, self._terms_offset + mid * TERM_RECORD.size
+            )
+            start = self._term_text_offset + offset
+            candidate = bytes(self._buffer[start:start + length])
+            if candidate == target:
+                return list(struct.unpack_from(
+                    f'<{count}I', self._buffer, self._postings_offset + first * POSTING.size
+                ))
+            if candidate < target:
+                low = mid + 1
+            else:
+                high = mid
+        return []
+
+    def rank(self, query_terms: set) -> List[int]:
+        """Order chunk indices by keyword overlap with the query.
+
+        Matches the ordering of a stable sort by overlap score: matching chunks
+        by descending overlap, then everything else in document order.
+        """
+        overlap = {}
+        for term in query_terms:
+            for index in self.postings(term):
+                overlap[index] = overlap.get(index, 0) + 1
+        matched = sorted(overlap, key=lambda index: (-overlap[index], index))
+        return matched + [index for index in range(self._count) if index not in overlap]
+
+
+class LoadedSession(Mapping):
+    """Session file opened via mmap, usable wherever ``process_pdf`` results are.
+
+    Exposes the same keys as a successful ``PDFProcessor.process_pdf`` result;
+    ``raw_text`` and ``clean_text`` are decoded only when first requested.
+    """
+
+    _KEYS = ('success', 'raw_text', 'clean_text', 'chunks', 'total_chars', 'num_chunks')
+
+    def __init__(self, session_path: str):
+        self.session_path = session_path
+        self._file = open(session_path, 'rb')
+        try:
+            self._mmap = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ)
+        except ValueError:
+            self._file.close()
+            raise ValueError(f"Session file {session_path} is empty")
+        self._buffer = memoryview(self._mmap)
+
+        try:
+            magic, version, _, index_length = HEADER.unpack_from(self._buffer, 0)
+        except struct.error:
+            self.close()
+            raise ValueError(f"Session file {session_path} is truncated")
+        if magic != SESSION_MAGIC:
+            self.close()
+            raise ValueError(f"{session_path} is not a ChatPDF session file")
+        if version != SESSION_VERSION:
+            self.close()
+            raise ValueError(f"Unsupported session version {version} (expected {SESSION_VERSION})")
+
+        try:
+            index_bytes = bytes(self._buffer[HEADER.size:HEADER.size + index_length])
+            self.index = json.loads(index_bytes.decode('utf-8'))
+            sections = self.index['sections']
+            end = max(offset + length for offset, length in sections.values())
+            num_chunks = int(self.index['num_chunks'])
+            if num_chunks * CHUNK_RECORD.size != sections['chunks'][1]:
+                raise ValueError('chunk table size mismatch')
+            if sections['terms'][1] % TERM_RECORD.size:
+                raise ValueError('term table size mismatch')
+        except (ValueError, KeyError, TypeError, AttributeError):
+            self.close()
+            raise ValueError(f"Session file {session_path} is corrupt")
+        if end > len(self._buffer):
+            self.close()
+            raise ValueError(f"Session file {session_path} is truncated")
+
+        self.pdf_path = self.index.get('pdf_path')
+        self.chunks = SessionChunks(self._buffer, sections, num_chunks)
+        self._text_cache = {}
+
+    def _section_text(self, name: str) -> str:
+        if name not in self._text_cache:
+            offset, length = self.index['sections'][name]
+            self._text_cache[name] = str(self._buffer[offset:offset + length], 'utf-8')
+        return self._text_cache[name]
+
+    def __getitem__(self, key):
+        if key == 'success':
+            return True
+        if key in ('raw_text', 'clean_text'):
+            return self._section_text(key)
+        if key == 'chunks':
+            return self.chunks
+        if key in ('total_chars', 'num_chunks'):
+            return self.index[key]
+        raise KeyError(key)
+
+    def __iter__(self):
+        return iter(self._KEYS)
+
+    def __len__(self) -> int:
+        return len(self._KEYS)
+
+    def close(self) -> None:
+        """Release the mapping and the underlying file"""
+        chunks = getattr(self, 'chunks', None)
+        if chunks is not None:
+            chunks._buffer = None
+        buffer = getattr(self, '_buffer', None)
+        if buffer is not None:
+            buffer.release()
+            self._buffer = None
+        if getattr(self, '_mmap', None) is not None:
+            self._mmap.close()
+            self._mmap = None
+        self._file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+
+def load_session(session_path: str) -> LoadedSession:
+    """Open a session file written by save_session"""
+    if not os.path.exists(session_path):
+        raise FileNotFoundError(f"Session file '{session_path}' not found")
+    session = LoadedSession(session_path)
+    logger.info(f"Loaded session with {session['num_chunks']} chunks from {session_path}")
+    return session
@@ -4,11 +4,20 @@ Basic tests for ChatPDF clone functionality
 """
 
 import os
+import shutil
 import sys
+import tempfile
+import threading
+import time
 import unittest
+from unittest import mock
 from pdf_processor import PDFProcessor
 from ai_handler import AIHandler
 from config import Config
+from session_store import save_session, load_session, HEADER, SESSION_MAGIC, SESSION_VERSION
+from token_budget import TokenBudget
+import ingest_daemon
+from ingest_daemon import IngestionDaemon
 
 class TestBasicFunctionality(unittest.TestCase):
     """Basic functionality tests"""
@@ -49,6 +58,321 @@ class TestBasicFunctionality(unittest.TestCase):
         self.assertIn('id', chunks[0], "Chunk missing ID")
         self.assertIn('text', chunks[0], "Chunk missing text")
 
+class TestSessionStore(unittest.TestCase):
+    """Test session save and reload"""
+    
+    def test_session_round_trip(self):
+        """Test that a saved session reloads with identical content"""
+        processor = PDFProcessor()
+        clean_text = processor.clean_text("Ünïcode text for the session. " * 80)
+        chunks = processor.chunk_text(clean_text, chunk_size=200, overlap=50)
+        pdf_data = {
+            'raw_text': clean_text,
+            'clean_text': clean_text,
+            'chunks': chunks,
+            'total_chars': len(clean_text),
+            'num_chunks': len(chunks)
+        }
+        
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            session_path = os.path.join(tmp_dir, 'test.cpdfs')
+            save_session(session_path, pdf_data, 'test.pdf')
+            
+            with load_session(session_path) as session:
+                self.assertEqual(session.pdf_path, 'test.pdf')
+                self.assertEqual(session['num_chunks'], len(chunks))
+                self.assertEqual(session['clean_text'], clean_text)
+                self.assertEqual(session['chunks'][-1]['text'], chunks[-1]['text'])
+                self.assertEqual([c['text'] for c in session['chunks']], [c['text'] for c in chunks])
+    
+    def test_session_term_index(self):
+        """Test that the stored term index ranks chunks like a full scan"""
+        texts = ["alpha beta gamma.", "beta delta.", "Gamma alpha alpha epsilon.", "zeta."]
+        clean_text = " ".join(texts)
+        chunks = []
+        position = 0
+        for i, text in enumerate(texts):
+            chunks.append({'id': i, 'text': text, 'start_pos': position, 'end_pos': position + len(text)})
+            position += len(text) + 1
+        pdf_data = {
+            'raw_text': clean_text,
+            'clean_text': clean_text,
+            'chunks': chunks,
+            'total_chars': len(clean_text),
+            'num_chunks': len(chunks)
+        }
+        
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            session_path = os.path.join(tmp_dir, 'terms.cpdfs')
+            save_session(session_path, pdf_data)
+            
+            with load_session(session_path) as session:
+                session_chunks = session['chunks']
+                self.assertEqual(session_chunks.postings('alpha'), [0, 2])
+                self.assertEqual(session_chunks.postings('missing'), [])
+                self.assertEqual(session_chunks.rank({'alpha', 'gamma', 'beta'}), [0, 2, 1, 3])
+    
+    def test_invalid_session_file(self):
+        """Test that non-session files are rejected"""
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            session_path = os.path.join(tmp_dir, 'bad.cpdfs')
+            with open(session_path, 'wb') as file:
+                file.write(b'not a session file at all')
+            with self.assertRaises(ValueError):
+                load_session(session_path)
+    
+    def test_corrupt_session_index(self):
+        """Test that a valid header with a broken index is rejected"""
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            session_path = os.path.join(tmp_dir, 'corrupt.cpdfs')
+            with open(session_path, 'wb') as file:
+                file.write(HEADER.pack(SESSION_MAGIC, SESSION_VERSION, 0, 16))
+                file.write(b'{not valid json!')
+            with self.assertRaisesRegex(ValueError, 'corrupt'):
+                load_session(session_path)
+
+class TestTokenBudget(unittest.TestCase):
+    """Test token budget allocation"""
+    
+    def setUp(self):
+        """Set up a budget that does not persist usage"""
+        self.budget = TokenBudget(Config(), usage_file='')
+    
+    def test_plan_per_query_type(self):
+        """Test that query types get their configured budgets"""
+        direct = self.budget.plan('direct')
+        indirect = self.budget.plan('indirect')
+        self.assertLess(direct['output_tokens'], indirect['output_tokens'])
+        self.assertLessEqual(indirect['context_tokens'], Config.MAX_TOKENS_PER_REQUEST)
+        self.assertFalse(direct['degraded'])
+    
+    def test_degrades_under_pressure(self):
+        """Test that requests shrink and then stop as the session cap is reached"""
+        full = self.budget.plan('general')
+        self.budget.record(int(Config.SESSION_TOKEN_CAP * 0.9), 0)
+        reduced = self.budget.plan('general')
+        self.assertTrue(reduced['degraded'])
+        self.assertLess(reduced['context_tokens'], full['context_tokens'])
+        self.assertLess(reduced['output_tokens'], full['output_tokens'])
+        
+        self.budget.record(Config.SESSION_TOKEN_CAP, 0)
+        self.assertTrue(self.budget.plan('general')['exhausted'])
+    
+    def test_degraded_plan_fits_one_chunk(self):
+        """Test that a degraded but usable plan still has room for a full chunk"""
+        processor = PDFProcessor()
+        chunks = processor.chunk_text("word " * 1000, Config.CHUNK_SIZE, Config.CHUNK_OVERLAP)
+        largest_chunk = max(len(chunk['text']) // 4 for chunk in chunks)
+        
+        self.budget.record(int(Config.SESSION_TOKEN_CAP * 0.95), 0)
+        plan = self.budget.plan('direct')
+        self.assertTrue(plan['degraded'])
+        self.assertFalse(plan['exhausted'])
+        self.assertGreaterEqual(plan['context_tokens'], largest_chunk)
+    
+    def test_unwritable_usage_file(self):
+        """Test that spend is still tracked when the ledger cannot be written"""
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            usage_file = os.path.join(tmp_dir, 'missing', 'usage.json')
+            budget = TokenBudget(Config(), usage_file=usage_file)
+            budget.record(100, 50)
+            report = budget.record(10, 0)
+            self.assertEqual(report['session_tokens'], 160)
+            self.assertEqual(report['daily_tokens'], 160)
+    
+    def test_non_positive_caps_rejected(self):
+        """Test that zero or negative spend caps fail validation"""
+        class ZeroCapConfig(Config):
+            GEMINI_API_KEY = 'test-key'
+            DAILY_TOKEN_CAP = 0
+        
+        with self.assertRaises(ValueError):
+            ZeroCapConfig.validate()
+    
+    def test_malformed_cap_rejected(self):
+        """Test that a non-numeric cap in the environment gives a readable error"""
+        class KeyedConfig(Config):
+            GEMINI_API_KEY = 'test-key'
+        
+        with mock.patch.dict(os.environ, {'DAILY_TOKEN_CAP': '200k'}):
+            with self.assertRaisesRegex(ValueError, 'DAILY_TOKEN_CAP'):
+                KeyedConfig.validate()
+    
+    def test_usage_ledger_accumulates(self):
+        """Test that separate sessions add to the same daily total"""
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            usage_file = os.path.join(tmp_dir, 'usage.json')
+            first = TokenBudget(Config(), usage_file=usage_file)
+            second = TokenBudget(Config(), usage_file=usage_file)
+            first.record(100, 50)
+            report = second.record(200, 0)
+            self.assertEqual(report['daily_tokens'], 350)
+            self.assertEqual(report['session_tokens'], 200)
+
+class TestIngestionDaemon(unittest.TestCase):
+    """Test watch-folder ingestion"""
+    
+    def test_ingest_directory_once(self):
+        """Test that PDFs in the watch directory are saved as sessions"""
+        if not os.path.exists('bert_research_paper.pdf'):
+            self.skipTest("bert_research_paper.pdf not found")
+        
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            watch_dir = os.path.join(tmp_dir, 'pdfs')
+            session_dir = os.path.join(tmp_dir, 'sessions')
+            os.makedirs(watch_dir)
+            # copy2 keeps the original mtime so the file is not treated as still being written
+            shutil.copy2('bert_research_paper.pdf', watch_dir)
+            
+            daemon = IngestionDaemon(watch_dir=watch_dir, session_dir=session_dir, workers=1)
+            stats = daemon.run_once()
+            self.assertEqual(stats['processed'], 1)
+            self.assertEqual(stats['failed'], 0)
+            
+            session_path = daemon.session_path_for(os.path.join(watch_dir, 'bert_research_paper.pdf'))
+            with load_session(session_path) as session:
+                self.assertGreater(session['num_chunks'], 0)
+            
+            # Unchanged files are not processed again
+            self.assertEqual(IngestionDaemon(watch_dir=watch_dir, session_dir=session_dir).scan(), [])
+    
+    def test_ingest_once_waits_for_fresh_files(self):
+        """Test that --once processes files that were still settling instead of skipping them"""
+        if not os.path.exists('bert_research_paper.pdf'):
+            self.skipTest("bert_research_paper.pdf not found")
+        
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            watch_dir = os.path.join(tmp_dir, 'pdfs')
+            os.makedirs(watch_dir)
+            # copy() gives the file a fresh mtime, as if it had just been written
+            shutil.copy('bert_research_paper.pdf', os.path.join(watch_dir, 'fresh.pdf'))
+            
+            daemon = IngestionDaemon(watch_dir=watch_dir, session_dir=os.path.join(tmp_dir, 'sessions'), workers=1)
+            self.assertEqual(daemon.scan(), [])
+            self.assertEqual(daemon.stats()['pending'], 1)
+            
+            stats = daemon.run_once()
+            self.assertEqual(stats['processed'], 1)
+            self.assertEqual(stats['pending'], 0)
+
+class BlockingProcessor(PDFProcessor):
+    """PDFProcessor stand-in that reads plain text files and can be held mid-run"""
+    
+    started = threading.Event()
+    release = threading.Event()
+    
+    def extract_text(self, pdf_path: str) -> str:
+        with open(pdf_path, 'r') as file:
+            text = file.read()
+        BlockingProcessor.started.set()
+        BlockingProcessor.release.wait(10)
+        return text
+
+class FlakyProcessor(PDFProcessor):
+    """PDFProcessor stand-in that reads plain text files and fails its first extraction"""
+    
+    calls = 0
+    
+    def extract_text(self, pdf_path: str) -> str:
+        FlakyProcessor.calls += 1
+        if FlakyProcessor.calls == 1:
+            raise IOError("transient read error")
+        with open(pdf_path, 'r') as file:
+            return file.read()
+
+class TestIngestionDaemonConcurrency(unittest.TestCase):
+    """Test ingestion when files change while being processed"""
+    
+    def test_file_changed_during_processing(self):
+        """Test that a file changed mid-run is reprocessed once the first run finishes"""
+        BlockingProcessor.started.clear()
+        BlockingProcessor.release.clear()
+        
+        with tempfile.TemporaryDirectory() as tmp_dir, \
+                mock.patch.object(ingest_daemon, 'PDFProcessor', BlockingProcessor):
+            watch_dir = os.path.join(tmp_dir, 'pdfs')
+            os.makedirs(watch_dir)
+            pdf_path = os.path.join(watch_dir, 'a.pdf')
+            settled = time.time() - 60
+            
+            with open(pdf_path, 'w') as file:
+                file.write("Version one text. " * 20)
+            os.utime(pdf_path, (settled, settled))
+            
+            daemon = IngestionDaemon(watch_dir=watch_dir, session_dir=os.path.join(tmp_dir, 'sessions'), workers=2)
+            daemon.start()
+            try:
+                self.assertEqual(daemon.scan(), [pdf_path])
+                self.assertTrue(BlockingProcessor.started.wait(10))
+                
+                with open(pdf_path, 'w') as file:
+                    file.write("Version two text. " * 20)
+                os.utime(pdf_path, (settled + 1, settled + 1))
+                
+                # Not queued again while the first run is still going
+                self.assertEqual(daemon.scan(), [])
+                self.assertEqual(daemon.stats()['pending'], 1)
+                
+                BlockingProcessor.release.set()
+                daemon.queue.join()
+                self.assertEqual(daemon.scan(), [pdf_path])
+                daemon.queue.join()
+            finally:
+                BlockingProcessor.release.set()
+                daemon.stop()
+            
+            with load_session(daemon.session_path_for(pdf_path)) as session:
+                self.assertIn("Version two", session['clean_text'])
+            self.assertEqual(daemon.scan(), [])
+    
+    def _write_settled(self, path: str, text: str) -> None:
+        """Write a text file with an mtime old enough to count as settled"""
+        with open(path, 'w') as file:
+            file.write(text)
+        settled = time.time() - 60
+        os.utime(path, (settled, settled))
+    
+    def test_failed_file_is_retried(self):
+        """Test that a failed PDF is retried without the file having to change"""
+        FlakyProcessor.calls = 0
+        
+        with tempfile.TemporaryDirectory() as tmp_dir, \
+                mock.patch.object(ingest_daemon, 'PDFProcessor', FlakyProcessor):
+            watch_dir = os.path.join(tmp_dir, 'pdfs')
+            os.makedirs(watch_dir)
+            pdf_path = os.path.join(watch_dir, 'a.pdf')
+            self._write_settled(pdf_path, "Some paper text. " * 20)
+            
+            daemon = IngestionDaemon(watch_dir=watch_dir, session_dir=os.path.join(tmp_dir, 'sessions'), workers=1)
+            daemon.config.INGEST_RETRY_DELAY = 0
+            daemon.start()
+            try:
+                daemon.scan()
+                daemon.queue.join()
+                stats = daemon.stats()
+                self.assertEqual(stats['failed'], 1)
+                self.assertEqual(stats['retrying'], 1)
+                
+                self.assertEqual(daemon.scan(), [pdf_path])
+                daemon.queue.join()
+            finally:
+                daemon.stop()
+            
+            stats = daemon.stats()
+            self.assertEqual(stats['processed'], 1)
+            self.assertEqual(stats['retrying'], 0)
+            self.assertTrue(os.path.exists(daemon.session_path_for(pdf_path)))
+    
+    def test_deferred_counts_files(self):
+        """Test that every file left out by a full queue is counted"""
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            for name in ('a.pdf', 'b.pdf', 'c.pdf'):
+                self._write_settled(os.path.join(tmp_dir, name), "text")
+            
+            daemon = IngestionDaemon(watch_dir=tmp_dir, session_dir=os.path.join(tmp_dir, 'sessions'), max_queue=1)
+            self.assertEqual(len(daemon.scan()), 1)
+            self.assertEqual(daemon.stats()['deferred'], 2)
+
 class TestAIHandler(unittest.TestCase):
     """Test AI handler functionality"""
     
@@ -72,6 +396,18 @@ class TestAIHandler(unittest.TestCase):
             self.assertEqual(classified_type, expected_type, 
                            f"Query '{query}' classified as '{classified_type}', expected '{expected_type}'")
     
+    def test_degraded_chunk_selection(self):
+        """Test that chunk selection with a degraded plan still returns content"""
+        budget = TokenBudget(Config(), usage_file='')
+        budget.record(int(Config.SESSION_TOKEN_CAP * 0.95), 0)
+        plan = budget.plan('general')
+        self.assertFalse(plan['exhausted'])
+        
+        sample_text = "BERT uses a bidirectional transformer encoder. " * 100
+        chunks = PDFProcessor().chunk_text(sample_text, Config.CHUNK_SIZE, Config.CHUNK_OVERLAP)
+        selected = self.ai_handler.select_relevant_chunks(chunks, "What is BERT?", plan['context_tokens'])
+        self.assertGreater(len(selected), 0, "Degraded plan selected no chunks")
+    
     def test_token_counting(self):
         """Test token counting functionality"""
         test_text = "This is a simple test sentence."
@@ -89,6 +425,10 @@ def run_tests():
     
     # Add test cases
     suite.addTests(loader.loadTestsFromTestCase(TestBasicFunctionality))
+    suite.addTests(loader.loadTestsFromTestCase(TestSessionStore))
+    suite.addTests(loader.loadTestsFromTestCase(TestTokenBudget))
+    suite.addTests(loader.loadTestsFromTestCase(TestIngestionDaemon))
+    suite.addTests(loader.loadTestsFromTestCase(TestIngestionDaemonConcurrency))
     suite.addTests(loader.loadTestsFromTestCase(TestAIHandler))
     
     # Run tests
@@ -0,0 +1,165 @@
+"""
+Token budget controller for sizing requests and tracking spend
+"""
+import json
+import os
+from contextlib import contextmanager
+from datetime import date
+from typing import Dict, Optional
+import logging
+from config import Config
+
+try:
+    import fcntl
+except ImportError:  # Windows: no cross-process locking for the ledger
+    fcntl = None
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+class TokenBudget:
+    """Allocates context and output tokens per query and tracks cumulative spend"""
+
+    def __init__(self, config: Optional[Config] = None, usage_file: Optional[str] = None):
+        self.config = config or Config()
+        self.usage_file = usage_file if usage_file is not None else self.config.USAGE_FILE
+        self.session_spent = 0
+        self.daily_usage = self._load_usage()
+
+    def _load_usage(self) -> Dict[str, int]:
+        """Load the per-day spend ledger"""
+        if not self.usage_file or not os.path.exists(self.usage_file):
+            return {}
+        try:
+            with open(self.usage_file, 'r') as file:
+                return {day: int(tokens) for day, tokens in json.load(file).items()}
+        except Exception as e:
+            logger.warning(f"Could not read usage file {self.usage_file}: {e}")
+            return {}
+
+    def _save_usage(self) -> None:
+        """Persist the per-day spend ledger, keeping the last 30 days"""
+        if not self.usage_file:
+            return
+        recent = dict(sorted(self.daily_usage.items())[-30:])
+        tmp_path = f"{self.usage_file}.tmp{os.getpid()}"
+        try:
+            with open(tmp_path, 'w') as file:
+                json.dump(recent, file)
+            # Atomic replace so readers never see a partially written ledger
+            os.replace(tmp_path, self.usage_file)
+            self.daily_usage = recent
+        except Exception as e:
+            logger.warning(f"Could not write usage file {self.usage_file}: {e}")
+            if os.path.exists(tmp_path):
+                os.unlink(tmp_path)
+
+    @contextmanager
+    def _ledger_lock(self):
+        """Hold an exclusive lock on the ledger across a read-update-write"""
+        if not self.usage_file or fcntl is None:
+            yield
+            return
+        # Lock a separate file, since os.replace swaps out the ledger itself
+        lock_file = None
+        try:
+            lock_file = open(f"{self.usage_file}.lock", 'a')
+            fcntl.flock(lock_file, fcntl.LOCK_EX)
+        except Exception as e:
+            # Spend has already been incurred, so carry on unlocked rather than fail the query
+            logger.warning(f"Could not lock usage file {self.usage_file}: {e}")
+            if lock_file is not None:
+                lock_file.close()
+                lock_file = None
+        try:
+            yield
+        finally:
+            if lock_file is not None:
+                fcntl.flock(lock_file, fcntl.LOCK_UN)
+                lock_file.close()
+
+    @property
+    def daily_spent(self) -> int:
+        return self.daily_usage.get(date.today().isoformat(), 0)
+
+    def remaining(self) -> int:
+        """Tokens left before hitting the tighter of the session and daily caps"""
+        return max(0, min(self.config.SESSION_TOKEN_CAP - self.session_spent,
+                          self.config.DAILY_TOKEN_CAP - self.daily_spent))
+
+    def pressure_scale(self) -> float:
+        """Fraction of the full per-query budget that can be spent right now"""
+        session_ratio = 1 - self.session_spent / self.config.SESSION_TOKEN_CAP
+        daily_ratio = 1 - self.daily_spent / self.config.DAILY_TOKEN_CAP
+        ratio = max(0.0, min(session_ratio, daily_ratio))
+        threshold = self.config.BUDGET_PRESSURE_THRESHOLD
+        if ratio >= threshold:
+            return 1.0
+        return ratio / threshold
+
+    def plan(self, query_type: str) -> Dict:
+        """Decide context and output token limits for a query type"""
+        context_tokens, output_tokens = self.config.QUERY_TOKEN_BUDGETS.get(
+            query_type, self.config.QUERY_TOKEN_BUDGETS['general']
+        )
+        overhead = self.config.PROMPT_OVERHEAD_TOKENS
+        min_context = self.config.MIN_CONTEXT_TOKENS
+        min_output = self.config.MIN_OUTPUT_TOKENS
+
+        # Respect the per-request ceilings
+        context_tokens = min(context_tokens, self.config.MAX_TOKENS_PER_REQUEST)
+        output_tokens = min(output_tokens, self.config.MAX_CONTEXT_LENGTH - overhead - context_tokens)
+
+        full_context, full_output = context_tokens, output_tokens
+
+        # Shrink under cap pressure, but never below the minimums
+        scale = self.pressure_scale()
+        context_tokens = max(min_context, int(context_tokens * scale))
+        output_tokens = max(min_output, int(output_tokens * scale))
+
+        # Make sure the request fits in what is left
+        remaining = self.remaining()
+        available = remaining - overhead
+        if context_tokens + output_tokens > available:
+            # Shorten the answer before the context, since context below one chunk is useless
+            output_tokens = max(min_output, available - context_tokens)
+            context_tokens = max(0, min(context_tokens, available - output_tokens))
+
+        # Below min_context not even one chunk fits, so there is nothing useful to send
+        exhausted = context_tokens < min_context or output_tokens < min_output
+        degraded = context_tokens < full_context or output_tokens < full_output
+
+        if degraded and not exhausted:
+            logger.info(f"Budget pressure: limiting to {context_tokens} context / {output_tokens} output tokens")
+
+        return {
+            'context_tokens': context_tokens,
+            'output_tokens': output_tokens,
+            'degraded': degraded,
+            'exhausted': exhausted,
+            'remaining': remaining
+        }
+
+    def record(self, prompt_tokens: int, output_tokens: int) -> Dict:
+        """Add a completed request to the session and daily totals and report spend"""
+        spent = prompt_tokens + output_tokens
+        today = date.today().isoformat()
+
+        # Re-read under the lock so concurrent sessions do not overwrite each other's spend.
+        # Other sessions only ever add, so taking the larger total per day also keeps this
+        # session's spend when the ledger cannot be read or written.
+        with self._ledger_lock():
+            ledger = self._load_usage()
+            for day, tokens in self.daily_usage.items():
+                ledger[day] = max(ledger.get(day, 0), tokens)
+            ledger[today] = ledger.get(today, 0) + spent
+            self.daily_usage = ledger
+            self._save_usage()
+        self.session_spent += spent
+
+        return {
+            'query_tokens': spent,
+            'session_tokens': self.session_spent,
+            'daily_tokens': self.daily_usage[today],
+            'remaining': self.remaining()
+        }
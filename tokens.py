@@ -0,0 +1,41 @@
+"""
+Token counting and term extraction shared by query handling and session files
+"""
+import threading
+from typing import Set
+import logging
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+_tokenizer = None
+_tokenizer_loaded = False
+_tokenizer_lock = threading.Lock()
+
+def count_tokens(text: str) -> int:
+    """Count tokens in text
+
+    Used for query-time chunk selection and for the counts stored in session
+    files, so the two always match.
+    """
+    global _tokenizer, _tokenizer_loaded
+    if not _tokenizer_loaded:
+        # Ingestion workers count tokens concurrently; load the tokenizer once
+        with _tokenizer_lock:
+            if not _tokenizer_loaded:
+                try:
+                    import tiktoken
+                    _tokenizer = tiktoken.get_encoding("cl100k_base")
+                except Exception as e:
+                    logger.warning(f"Could not initialize tokenizer: {e}")
+                _tokenizer_loaded = True
+    
+    if _tokenizer:
+        return len(_tokenizer.encode(text))
+    else:
+        # Rough estimation: ~4 characters per token
+        return len(text) // 4
+
+def chunk_terms(text: str) -> Set[str]:
+    """Terms used for keyword relevance scoring"""
+    return set(text.lower().split())